@@ -59,6 +59,7 @@ class BaseGeoProApp(QMainWindow, QLogger):
         self.file_row_map = {}
         self.thread_execution = None
         self.row_colors = None
+        self.relevant_places_cache = {}
 
         self._init_window()
         self.init_ui_logging(log, logging.INFO)
@@ -388,7 +389,26 @@ class BaseGeoProApp(QMainWindow, QLogger):
             self.row_colors.append(ColorRole.INIT)
 
     def update_table(self):
-        pass
+        # stat all files first to skip unchanged ones and read the remaining ones in on-disk order
+        file_stats = list()
+        for path in self.source_files:
+            try:
+                file_stats.append((path, os.stat(path)))
+            except OSError as e:
+                log.warning(f"Could not access file {path}: {e}")
+                self.output_table.item(self.file_row_map[path], 1).setText("0")
+        file_stats.sort(key=lambda path_stat: path_stat[1].st_ino)
+
+        # update number of relevant rows
+        for path, stat in file_stats:
+            file_signature = (stat.st_mtime_ns, stat.st_size)
+            cached = self.relevant_places_cache.get(path)
+            if cached is not None and cached[0] == file_signature:
+                relevant = cached[1]
+            else:
+                relevant = self.count_relevant_places(path)
+                self.relevant_places_cache[path] = (file_signature, relevant)
+            self.output_table.item(self.file_row_map[path], 1).setText(str(relevant))
 
     def set_processing_result(self, file_path, successful_rows, skipped_rows):
         if file_path not in self.file_row_map:
@@ -409,13 +429,13 @@ class BaseGeoProApp(QMainWindow, QLogger):
 
         if finished:
             if skipped_rows > 0:
-                color = Colors.TableBackground[RunningConfig.theme][ColorRole.SKIPPED]
+                color = Colors.bg(RunningConfig.theme, ColorRole.SKIPPED)
                 self.row_colors[row] = ColorRole.SKIPPED
             else:
-                color = Colors.TableBackground[RunningConfig.theme][ColorRole.SUCCESS]
+                color = Colors.bg(RunningConfig.theme, ColorRole.SUCCESS)
                 self.row_colors[row] = ColorRole.SUCCESS
         elif total_processed > 0:
-            color = Colors.TableBackground[RunningConfig.theme][ColorRole.ACTIVE]
+            color = Colors.bg(RunningConfig.theme, ColorRole.ACTIVE)
             self.row_colors[row] = ColorRole.ACTIVE
         else:
             return
@@ -436,7 +456,7 @@ class BaseGeoProApp(QMainWindow, QLogger):
                 # skip if color has not been changed
                 continue
 
-            color = QColor(Colors.TableBackground[RunningConfig.theme][role])
+            color = QColor(Colors.bg(RunningConfig.theme, role))
 
             for col in range(self.output_table.columnCount()):
                 item = self.output_table.item(row, col)
@@ -532,6 +552,10 @@ class BaseGeoProApp(QMainWindow, QLogger):
     # Hooks
     # ------------------------------------------------------------------
 
+    def count_relevant_places(self, file_path):
+        """Must be implemented by subclass"""
+        raise NotImplementedError
+
     def execute(self):
         """Must be implemented by subclass"""
         raise NotImplementedError
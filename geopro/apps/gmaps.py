@@ -103,12 +103,6 @@ class GMapsGeoProApp(BaseGeoProApp):
     # ------------------------------------------------------------------
     # CSV relevance counting
     # ------------------------------------------------------------------
-    def update_table(self):
-        # 1. update number of relevant rows
-        for path in self.source_files:
-            relevant = self.count_relevant_places(path)
-            self.output_table.item(self.file_row_map[path], 1).setText(str(relevant))
-
     def count_relevant_places(self, csv_path):
         """Count non-empty rows where URL column contains Google Maps."""
         try:
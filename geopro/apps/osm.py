@@ -2,7 +2,9 @@
 
 import sys
 import os
+import re
 import json
+import mmap
 import logging
 
 from PyQt5.QtCore import Qt, QEventLoop, QObject, pyqtSignal, pyqtSlot, QPoint, QSize
@@ -23,6 +25,13 @@ log.setLevel(logging.DEBUG)
 
 DEFAULT_THRESHOLD = 0.7
 
+# Byte patterns of the GeoJSON files written by the GMaps app (json.dump with default separators)
+GEOJSON_HEADER = b'{"type": "FeatureCollection"'
+GEOJSON_FEATURE_TOKEN = b'"type": "Feature"'
+# Leading "type" member of an arbitrary GeoJSON file, checked on the first few KB only
+GEOJSON_SNIFF_SIZE = 4096
+GEOJSON_TYPE_RE = re.compile(rb'\s*\{\s*"type"\s*:\s*"([^"]*)"')
+
 
 class MapBridge(QObject):
     markerClicked = pyqtSignal(int)
@@ -456,22 +465,26 @@ class OSMGeoProApp(BaseGeoProApp):
     # ------------------------------------------------------------------
     # CSV relevance counting
     # ------------------------------------------------------------------
-    def update_table(self):
-        # 1. update number of relevant rows
-        for path in self.source_files:
-            relevant = self.count_relevant_places(path)
-            self.output_table.item(self.file_row_map[path], 1).setText(str(relevant))
-
     def count_relevant_places(self, file_path):
-        """Count non-empty rows where URL column contains Google Maps."""
-
         """
         Return the number of features in a GeoJSON FeatureCollection.
 
         :param file_path: Path to a .geojson file
         :return: Number of features, or 0 if invalid
         """
+        num_features = self.count_features_fast(file_path)
+        if num_features is not None:
+            return num_features
+
         try:
+            # reject files whose leading "type" member already rules out a FeatureCollection before parsing them
+            with open(file_path, "rb") as f:
+                head = f.read(GEOJSON_SNIFF_SIZE)
+            match = GEOJSON_TYPE_RE.match(head)
+            if match is not None and match.group(1) != b"FeatureCollection":
+                log.warning(f"File {file_path} does not contain a FeatureCollection.")
+                return 0
+
             with open(file_path, "r", encoding="utf-8") as f:
                 data = json.load(f)
 
@@ -490,6 +503,28 @@ class OSMGeoProApp(BaseGeoProApp):
             log.error(f"Error decoding file {file_path}: {e}")
             return 0
 
+    @staticmethod
+    def count_features_fast(file_path):
+        """
+        Count the features of a GeoJSON file written by the GMaps app without parsing it.
+
+        :param file_path: Path to a .geojson file
+        :return: Number of features, or None if the file doesn't look like one of our own outputs
+        """
+        try:
+            with open(file_path, "rb") as f:
+                if f.read(len(GEOJSON_HEADER)) != GEOJSON_HEADER:
+                    return None
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    count = 0
+                    pos = mm.find(GEOJSON_FEATURE_TOKEN)
+                    while pos != -1:
+                        count += 1
+                        pos = mm.find(GEOJSON_FEATURE_TOKEN, pos + len(GEOJSON_FEATURE_TOKEN))
+                    return count
+        except (OSError, ValueError):
+            return None
+
     # ------------------------------------------------------------------
     # Map matching
     # ------------------------------------------------------------------
@@ -780,6 +815,8 @@ class OSMGeoProApp(BaseGeoProApp):
         # call parent to wait for thread to stop
         super().closeEvent(event)
 
+        self.osm_matcher.close()
+
 
 def main():
     app = QApplication(sys.argv)
@@ -1,6 +1,5 @@
 import os
 import logging
-from dataclasses import dataclass
 from enum import Enum, auto
 
 import geopro
@@ -12,11 +11,15 @@ PATH_RESOURCES = os.path.join(package_path, "resources")
 PATH_BOOKMARK_ICONS = os.path.join(PATH_RESOURCES, "bookmark_icons.yaml")
 PATH_PLACE_MAPPING = os.path.join(PATH_RESOURCES, "mapcss-mapping.csv")
 PATH_CHROME = os.path.join(package_path, "chrome")
+PATH_CACHE = os.path.join(os.path.expanduser("~"), ".cache", "geopro")
+PATH_CHROMEDRIVER_CACHE = os.path.join(PATH_CACHE, "chromedriver_path")
+PATH_OVERPASS_CACHE = os.path.join(PATH_CACHE, "overpass.sqlite")
+# The version has to be increased whenever the pickled MapCSS rules or their format change
+PATH_PLACE_MAPPING_CACHE = os.path.join(PATH_CACHE, "mapcss-rules-v3.pickle")
 
 RANGES = [10, 30, 100, 1000, 5000]
 DEFAULT_RANGE = RANGES[2]
 
-@dataclass(frozen=True)
 class Animations:
     COMPLETED = "completed"
     MATCHING = "matching"
@@ -27,25 +30,21 @@ class Animations:
         log.debug(f"Animation path: {os.path.join(package_path, f'{animation}_{RunningConfig.theme}.gif')}")
         return os.path.join(PATH_RESOURCES, f"{animation}_{RunningConfig.theme}.gif")
 
-@dataclass(frozen=True)
 class AnimationStates:
     PLAYING = "playing"
     STOPPED = "stopped"
     FRAME = "frame"
 
-@dataclass(frozen=True)
 class Icons:
     MARKER_MATCH = os.path.join(PATH_RESOURCES, "icon_marker_match.svg")
     MARKER_ORIGINAL = os.path.join(PATH_RESOURCES, "icon_marker_original.svg")
 
 
-@dataclass(frozen=True)
 class Themes:
     DARK = "dark"
     LIGHT = "light"
 
 
-@dataclass(frozen=True)
 class Commands:
     ZOOM_IN = "zoom-in"
     ZOOM_OUT = "zoom-out"
@@ -73,6 +72,15 @@ class Colors:
         },
     }
 
+    # flat (theme, role) -> color lookup, built once from TableBackground
+    _TABLE_BACKGROUND_FLAT = {
+        (theme, role): color for theme, roles in TableBackground.items() for role, color in roles.items()
+    }
+
+    @classmethod
+    def bg(cls, theme, role):
+        return cls._TABLE_BACKGROUND_FLAT[(theme, role)]
+
 
 class RunningConfig:
     theme = Themes.DARK
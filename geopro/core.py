@@ -1,5 +1,6 @@
 from dataclasses import dataclass
-from typing import List
+from functools import cached_property, lru_cache
+from typing import Tuple
 
 from PyQt5.QtCore import QObject, pyqtSignal
 
@@ -7,20 +8,21 @@ from PyQt5.QtCore import QObject, pyqtSignal
 @dataclass(frozen=True)
 class FileType:
     name: str
-    extensions: List[str]
+    extensions: Tuple[str, ...]
 
-    @property
+    @cached_property
     def dialog_filter(self) -> str:
         return f"{self.name} ({' '.join('*' + e for e in self.extensions)})"
 
 
 class FileTypeConfig:
-    CSV = FileType("CSV Files", [".csv"])
-    JSON = FileType("JSON Files", [".json"])
-    GEOJSON = FileType("GeoJSON Files", [".geojson"])
-    KML = FileType("KML Files", [".kml"])
+    CSV = FileType("CSV Files", (".csv",))
+    JSON = FileType("JSON Files", (".json",))
+    GEOJSON = FileType("GeoJSON Files", (".geojson",))
+    KML = FileType("KML Files", (".kml",))
 
     @classmethod
+    @lru_cache(maxsize=None)
     def dialog_filter(cls, *types: FileType) -> str:
         return ";;".join(t.dialog_filter for t in types)
 
@@ -1,23 +1,13 @@
-from selenium import webdriver
-from selenium.webdriver.common.by import By
-from selenium.common.exceptions import NoSuchElementException
-from selenium.webdriver.chrome.service import Service
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from webdriver_manager.chrome import ChromeDriverManager
 from datetime import datetime
 from urllib.parse import unquote
 
-import pandas as pd
 import json
 import time
 import re
 import os
 import logging
-import requests
-import simplekml
 
-from geopro.config import PATH_CHROME
+from geopro.config import PATH_CHROME, PATH_CACHE, PATH_CHROMEDRIVER_CACHE
 from geopro.log import setup_add_logger
 
 log = logging.getLogger("geopro")
@@ -27,6 +17,21 @@ setup_add_logger(log, "WDM")
 # Config
 DATETIME_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
 TIMEOUT = 10
+CHROMEDRIVER_CACHE_TTL = 24 * 60 * 60  # seconds
+
+# Looks up the address of a place in a single browser round trip: the address element if there is one,
+# otherwise the texts of the title and the first two subtitles
+SCRIPT_FIND_ADDRESS = """
+const first = (xpath) => document.evaluate(xpath, document, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null)
+    .singleNodeValue;
+const text = (element) => element === null ? null : element.innerText;
+const element_address = first("//div[contains(@class, 'Io6YTe')]") || first("//span[contains(@class, 'DkEaL')]");
+return [text(element_address), ["//h1", "(//h2/span)[1]", "(//h2/span)[2]"].map((xpath) => text(first(xpath)))];
+"""
+
+
+# Path of the chrome driver installed by the webdriver manager, resolved once per process
+_chromedriver_path = None
 
 
 class SupportedMethods:
@@ -59,7 +64,63 @@ def extract_lat_lng(url):
         return float(latitude), float(longitude)
     return None, None
 
+def get_chromedriver_path():
+    """
+    Return the path of the chrome driver, only asking the webdriver manager for it once a day.
+    """
+    global _chromedriver_path
+    if _chromedriver_path is not None:
+        return _chromedriver_path
+
+    try:
+        if time.time() - os.path.getmtime(PATH_CHROMEDRIVER_CACHE) < CHROMEDRIVER_CACHE_TTL:
+            with open(PATH_CHROMEDRIVER_CACHE, "r", encoding="utf-8") as f:
+                cached_path = f.read().strip()
+            if os.path.isfile(cached_path):
+                _chromedriver_path = cached_path
+                return _chromedriver_path
+    except OSError:
+        pass
+
+    from webdriver_manager.chrome import ChromeDriverManager
+
+    _chromedriver_path = ChromeDriverManager().install()
+
+    try:
+        os.makedirs(PATH_CACHE, exist_ok=True)
+        with open(PATH_CHROMEDRIVER_CACHE, "w", encoding="utf-8") as f:
+            f.write(_chromedriver_path)
+    except OSError as e:
+        log.debug(f"Could not cache chrome driver path: {e}")
+
+    return _chromedriver_path
+
+def build_place_feature(name, latitude, longitude, url, place_id, address, datetime_now, note):
+    """
+    Build the GeoJSON point feature for a scraped place.
+    """
+    return {
+        'type': 'Feature',
+        'geometry': {
+            'type': 'Point',
+            'coordinates': [longitude, latitude]
+        },
+        'properties': {
+            'name': name,  # Assuming a name field
+            'date': datetime_now,
+            'description': note,
+            'google_maps_url': url,
+            'google_maps_place_id': place_id,
+            'location': {
+                'address': address,
+                'name': name
+            }
+        }
+    }
+
 def convert_geojson_to_kml(geojson_data):
+    import simplekml
+
     # Create a new KML object
     kml = simplekml.Kml()
 
@@ -111,18 +172,15 @@ class GMapsScraper:
         self.update_function = update_function
 
     def init_webdriver(self, run_headless):
+        from selenium import webdriver
+        from selenium.webdriver.chrome.service import Service
+
         # Setup Selenium Chrome driver
         options = webdriver.ChromeOptions()
         options.add_argument(f'user-data-dir={PATH_CHROME}')
         if run_headless:
             options.add_argument('--headless')
-        self.driver = webdriver.Chrome(options=options, service=Service(ChromeDriverManager().install()))
-
-    def find_element(self, by, value):
-        try:
-            return self.driver.find_element(by, value)
-        except NoSuchElementException:
-            return None
+        self.driver = webdriver.Chrome(options=options, service=Service(get_chromedriver_path()))
 
     @staticmethod
     def geocode_address(api_key, place_url, language="de"):
@@ -134,6 +192,8 @@ class GMapsScraper:
         :param language: str, optional, language code for returned address
         :return: dict with lat, lng, place_id, formatted_address or None if not found
         """
+        import requests
+
         params = {
             "key": api_key,
             "language": language,
@@ -178,6 +238,10 @@ class GMapsScraper:
     # Function to extract coordinates from Google Maps URL
     def extract_coordinates(self, url, scraping_method=SupportedMethods.SELENIUM, first_run=False, run_headless=False,
                            language="de", api_key=None):
+        from selenium.webdriver.common.by import By
+        from selenium.webdriver.support.ui import WebDriverWait
+        from selenium.webdriver.support import expected_conditions as EC
+
         if scraping_method == SupportedMethods.SELENIUM:
             log.debug("Using selenium to scrape information")
             self.init_webdriver(run_headless)
@@ -211,29 +275,18 @@ class GMapsScraper:
                 else:
                     log.debug(f"Latitude: {latitude}, Longitude: {longitude}")
 
-                address = None
-                element_address = self.find_element(By.XPATH, '//div[contains(@class, \'Io6YTe\')]')
-                if element_address is None:
-                    element_address = self.find_element(By.XPATH, '//span[contains(@class, \'DkEaL\')]')
-                    if element_address is None:
-                        elements_address = list()
-                        elements_address.append(self.find_element(By.XPATH, "//h1"))
-                        elements_address.append(self.find_element(By.XPATH, "(//h2/span)[1]"))
-                        elements_address.append(self.find_element(By.XPATH, "(//h2/span)[2]"))
-
-                        address = ""
-                        for element_address_i in elements_address:
-                            if element_address_i is not None:
-                                if address != "":
-                                    address += ", "
-                                address += element_address_i.text.strip()
-
-                        if address == "":
-                            address = None
-                            log.warning(f"Could not find an address for: {url}")
-
-                if element_address is not None and address is None:
-                    address = str(element_address.text)
+                address, fallback_texts = self.driver.execute_script(SCRIPT_FIND_ADDRESS)
+                if address is None:
+                    address = ""
+                    for text_i in fallback_texts:
+                        if text_i is not None:
+                            if address != "":
+                                address += ", "
+                            address += text_i.strip()
+
+                    if address == "":
+                        address = None
+                        log.warning(f"Could not find an address for: {url}")
                 log.debug(address)
 
                 return latitude, longitude, address, None
@@ -276,13 +329,16 @@ class GMapsScraper:
     def scrape_from_file(self, input_file, output_file, overwrite_output=False, run_headless=False,
                          language="de", scraping_method=SupportedMethods.SELENIUM, api_key=None, save_kml=True):
 
+        import pandas as pd
+
         log.info(f"Beginning scraping for file: {input_file}")
 
         # Load your CSV file
         df = pd.read_csv(input_file)  # Replace with your CSV file path
         df = df.fillna("")
 
-        features = []
+        # Scraped places are collected as flat tuples and only converted to GeoJSON features when writing
+        places = []
 
         num_success = 0
         num_failed = 0
@@ -314,24 +370,7 @@ class GMapsScraper:
                 # Format the time as a string
                 datetime_now = current_time.strftime(DATETIME_FORMAT)
 
-                features.append({
-                    'type': 'Feature',
-                    'geometry': {
-                        'type': 'Point',
-                        'coordinates': [longitude, latitude]
-                    },
-                    'properties': {
-                        'name': name,  # Assuming a name field
-                        'date': datetime_now,
-                        'description': note,
-                        'google_maps_url': url,
-                        'google_maps_place_id': place_id,
-                        'location': {
-                            'address': address,
-                            'name': name
-                        }
-                    }
-                })
+                places.append((name, latitude, longitude, url, place_id, address, datetime_now, note))
                 if latitude is None or longitude is None or address is None:
                     num_failed += 1
                 else:
@@ -345,12 +384,12 @@ class GMapsScraper:
         # Create GeoJSON structure
         geojson_data = {
             'type': 'FeatureCollection',
-            'features': features
+            'features': [build_place_feature(*place) for place in places]
         }
 
         # Save to GeoJSON file
         output_file_geojson = output_file
-        if os.path.exists(output_file_geojson) and overwrite_output or not os.path.exists(output_file_geojson):
+        if overwrite_output or not os.path.exists(output_file_geojson):
             with open(output_file_geojson, 'w') as f:
                 json.dump(geojson_data, f)
             log.info(f"GeoJSON file {output_file_geojson} has been created successfully!")
@@ -360,7 +399,7 @@ class GMapsScraper:
         # Save to KML file
         if save_kml:
             output_file_kml = output_file.replace(".geojson", ".kml")
-            if os.path.exists(output_file_kml) and overwrite_output or not os.path.exists(output_file_kml):
+            if overwrite_output or not os.path.exists(output_file_kml):
                 kml = convert_geojson_to_kml(geojson_data)
                 kml.save(output_file_kml)
                 log.info(f"KML file {output_file_kml} has been created successfully!")
@@ -3,27 +3,46 @@ import re
 import math
 import logging
 import os
-import json
+import pickle
+import orjson
 import random
 import time
 import yaml
 import urllib3
+import sqlite3
+import hashlib
+import zlib
+import threading
+import numpy as np
 
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import lru_cache
 from pathlib import Path
 from typing import Callable
-from pykml.factory import KML_ElementMaker as KML
+from requests.adapters import HTTPAdapter
 from lxml import etree
+from lxml.builder import ElementMaker
 
-from geopro.config import PATH_BOOKMARK_ICONS, PATH_PLACE_MAPPING, RANGES, DEFAULT_RANGE, Commands, UserSelection
-from geopro.functions.places_feature_matching import parse_mapcss, leave_longest_types, OsmTag, \
-    convert_list_to_feature_types
+from geopro.config import PATH_BOOKMARK_ICONS, PATH_PLACE_MAPPING, PATH_CACHE, PATH_OVERPASS_CACHE, \
+    PATH_PLACE_MAPPING_CACHE, RANGES, DEFAULT_RANGE, Commands, UserSelection
+from geopro.functions.places_feature_matching import parse_mapcss, leave_longest_types, \
+    convert_list_to_feature_types, index_rules_by_key, intern_rules
 
 log = logging.getLogger("geopro")
 log.setLevel(logging.DEBUG)
 
+EARTH_RADIUS = 6371000  # Earth radius in meters
+
+KML_NS = "http://www.opengis.net/kml/2.2"
 MWM_NS = "https://comaps.app"  # The namespace for mwm
 NSMAP = {"mwm": MWM_NS}
 
+KML_NSMAP = {None: KML_NS, **NSMAP}
+
+# Element factories for the KML placemarks
+KML = ElementMaker(namespace=KML_NS, nsmap=KML_NSMAP)
+MWM = ElementMaker(namespace=MWM_NS, nsmap=NSMAP)
+
 OVERPASS_ENDPOINTS = [
     "https://overpass.lirose/api/interpreter",
     # "https://overpass-api.de/api/interpreter",
@@ -31,6 +50,23 @@ OVERPASS_ENDPOINTS = [
     # "https://overpass.nchc.org.tw/api/interpreter",
 ]
 
+# Overpass QL templates, a query is the header followed by one or more statements. Coordinates are
+# rounded to 5 decimals (~1 m), so that repeated places produce identical, cacheable queries.
+OVERPASS_QUERY_HEADER = "[out:json][timeout:{timeout}];"
+OVERPASS_SEARCH_STATEMENT = '{place_type}["name"~"{name_regex}",i](around:{radius},{lat:.5f},{lon:.5f});out center qt;'
+
+# Number and minimum length of the words searched for per place
+SEARCH_WORDS_MAX = 3
+SEARCH_WORD_MIN_LENGTH = 4
+
+# Limits the number of concurrent requests per endpoint to respect the Overpass fair-use policy
+OVERPASS_ENDPOINT_SLOTS = {url: threading.Semaphore(2) for url in OVERPASS_ENDPOINTS}
+OVERPASS_BATCH_SIZE = 25  # places per batched Overpass request
+OVERPASS_WORKERS = 4
+OVERPASS_RETRY_AFTER_MAX = 60  # seconds, upper bound for waiting on a Retry-After header
+
+OVERPASS_CACHE_TTL = 30 * 24 * 60 * 60  # seconds
+
 
 class MatchingMethods:
     ALL = "all"
@@ -42,8 +78,207 @@ class DuplicateError(Exception):
     pass
 
 
+class TokenBucket:
+    """
+    Thread-safe token bucket allowing `rate` requests per second on average and bursts of up to `burst`.
+    """
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.last_update = time.monotonic()
+        self.lock = threading.Lock()
+
+    def take(self):
+        """
+        Take a token, blocking until one is available.
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.last_update) * self.rate)
+            self.last_update = now
+            # Reserve the token right away, so waiting threads queue up behind each other
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+
+        if wait > 0:
+            log.debug("Throttling Overpass request for %.2fs", wait)
+            time.sleep(wait)
+
+
+class EndpointPool:
+    """
+    Thread-safe round-robin over endpoints, skipping endpoints that recently failed for an
+    exponentially growing cooldown.
+    """
+    def __init__(self, endpoints: list, max_cooldown: float = 60.0):
+        self.endpoints = list(endpoints)
+        self.max_cooldown = max_cooldown
+        self.failures = {url: 0 for url in self.endpoints}
+        self.cooldown_until = {url: 0.0 for url in self.endpoints}
+        self.next_index = 0
+        self.lock = threading.Lock()
+
+    def pick(self) -> str:
+        """
+        Return the next endpoint that is not cooling down, or the next one of all if every endpoint is.
+        """
+        with self.lock:
+            now = time.monotonic()
+            available = [url for url in self.endpoints if self.cooldown_until[url] <= now] or self.endpoints
+            url = available[self.next_index % len(available)]
+            self.next_index += 1
+            return url
+
+    def report_success(self, url: str):
+        with self.lock:
+            self.failures[url] = 0
+            self.cooldown_until[url] = 0.0
+
+    def report_failure(self, url: str):
+        with self.lock:
+            self.failures[url] += 1
+            self.cooldown_until[url] = time.monotonic() + min(2 ** self.failures[url], self.max_cooldown)
+
+
+# Paces the requests per endpoint to respect the Overpass fair-use policy
+OVERPASS_ENDPOINT_BUCKETS = {url: TokenBucket(rate=1.0, burst=2) for url in OVERPASS_ENDPOINTS}
+OVERPASS_ENDPOINT_POOL = EndpointPool(OVERPASS_ENDPOINTS)
+
+
+def overpass_cache_key(query: str) -> str:
+    return hashlib.blake2b(query.encode("utf-8")).hexdigest()
+
+def connect_overpass_cache():
+    os.makedirs(PATH_CACHE, exist_ok=True)
+    connection = sqlite3.connect(PATH_OVERPASS_CACHE)
+    connection.execute("CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, ts INTEGER, body BLOB)")
+    return connection
+
+def read_overpass_cache(query: str):
+    """
+    Return the cached Overpass response for the query, or None if there is no fresh one.
+    """
+    try:
+        connection = connect_overpass_cache()
+        try:
+            row = connection.execute("SELECT body, ts FROM cache WHERE key = ?",
+                                     (overpass_cache_key(query),)).fetchone()
+        finally:
+            connection.close()
+    except sqlite3.Error as e:
+        log.warning(f"Failed to read Overpass cache: {e}")
+        return None
+
+    if row is None or row[1] < time.time() - OVERPASS_CACHE_TTL:
+        return None
+
+    try:
+        return orjson.loads(zlib.decompress(row[0]))
+    except (zlib.error, orjson.JSONDecodeError) as e:
+        # A corrupt row is dropped, so that the query is fetched and cached again
+        log.warning(f"Discarding corrupt Overpass cache entry: {e}")
+        delete_overpass_cache(query)
+        return None
+
+def write_overpass_cache(query: str, data: dict):
+    try:
+        connection = connect_overpass_cache()
+        try:
+            with connection:
+                connection.execute("INSERT OR REPLACE INTO cache (key, ts, body) VALUES (?, ?, ?)",
+                                   (overpass_cache_key(query), int(time.time()),
+                                    zlib.compress(orjson.dumps(data))))
+        finally:
+            connection.close()
+    except sqlite3.Error as e:
+        log.warning(f"Failed to write Overpass cache: {e}")
+
+def delete_overpass_cache(query: str):
+    try:
+        connection = connect_overpass_cache()
+        try:
+            with connection:
+                connection.execute("DELETE FROM cache WHERE key = ?", (overpass_cache_key(query),))
+        finally:
+            connection.close()
+    except sqlite3.Error as e:
+        log.warning(f"Failed to delete Overpass cache entry: {e}")
+
+def prune_overpass_cache():
+    """
+    Delete the Overpass responses that are older than the cache TTL.
+    """
+    try:
+        connection = connect_overpass_cache()
+        try:
+            with connection:
+                connection.execute("DELETE FROM cache WHERE ts < ?", (int(time.time() - OVERPASS_CACHE_TTL),))
+        finally:
+            connection.close()
+    except sqlite3.Error as e:
+        log.warning(f"Failed to prune Overpass cache: {e}")
+
+
+def place_matching_source_key(place_mapping_file: Path) -> str:
+    # Hash of the MapCSS file the rules are parsed from. Modification times can't be relied on, as other
+    # installations share the cache and packages keep the archived modification times.
+    return hashlib.blake2b(place_mapping_file.read_bytes()).hexdigest()
+
+def read_place_matching_cache(place_mapping_file: Path):
+    """
+    Return the cached rules parsed from the MapCSS file, or None if the cache is missing or was parsed
+    from a different file.
+    """
+    cache_file = Path(PATH_PLACE_MAPPING_CACHE)
+    try:
+        with cache_file.open("rb") as f:
+            source_key, rules = pickle.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        log.warning(f"Failed to read MapCSS rules cache: {e}")
+        return None
+
+    if source_key != place_matching_source_key(place_mapping_file):
+        return None
+
+    # Unpickled strings are not interned, intern them again like parse_mapcss does
+    intern_rules(rules)
+    return rules
+
+def write_place_matching_cache(place_mapping_file: Path, rules):
+    cache_file = Path(PATH_PLACE_MAPPING_CACHE)
+    part_file = cache_file.with_name(cache_file.name + ".part")
+    try:
+        os.makedirs(PATH_CACHE, exist_ok=True)
+        with part_file.open("wb") as f:
+            pickle.dump((place_matching_source_key(place_mapping_file), rules), f,
+                        protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(part_file, cache_file)
+    except OSError as e:
+        log.warning(f"Failed to write MapCSS rules cache: {e}")
+
+
+def write_element(xml_writer, element, level: int = 0):
+    """
+    Write an element tree into an lxml xmlfile, indented by level.
+
+    Writing the elements through nested xmlfile contexts reuses the namespaces declared on the enclosing
+    elements, whereas writing a whole element serializes it standalone with its own declarations.
+    """
+    indent = "\n" + "  " * level
+    xml_writer.write(indent)
+    with xml_writer.element(element.tag, element.attrib):
+        if element.text:
+            xml_writer.write(element.text)
+        for child in element:
+            write_element(xml_writer, child, level + 1)
+        if len(element):
+            xml_writer.write(indent)
+
+
 def haversine_distance(lat1, lon1, lat2, lon2):
-    R = 6371000  # Earth radius in meters
     phi1 = math.radians(lat1)
     phi2 = math.radians(lat2)
     dphi = math.radians(lat2 - lat1)
@@ -53,32 +288,81 @@ def haversine_distance(lat1, lon1, lat2, lon2):
             math.sin(dphi / 2) ** 2
             + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
     )
-    return 2 * R * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+    # a can exceed 1 by rounding errors for antipodal points
+    return 2 * EARTH_RADIUS * math.asin(min(1.0, math.sqrt(a)))
+
+def haversine_vector(lat, lon, lats, lons):
+    """
+    Vectorized version of haversine_distance from a single point to arrays of points.
+    """
+    # The trigonometry of the single point is only computed once, as scalars
+    phi1 = math.radians(lat)
+    cos_phi1 = math.cos(phi1)
+
+    phi2 = np.radians(lats)
+    dphi = phi2 - phi1
+    dlambda = np.radians(lons - lon)
+
+    a = (
+            np.sin(dphi / 2) ** 2
+            + cos_phi1 * np.cos(phi2) * np.sin(dlambda / 2) ** 2
+    )
+    # a can exceed 1 by rounding errors for antipodal points
+    return 2 * EARTH_RADIUS * np.arcsin(np.minimum(1.0, np.sqrt(a)))
+
+WORD_RE = re.compile(r"[A-Za-z]+(?:'[A-Za-z]+)?")
+NAME_SPLIT_RE = re.compile(r"\W+")
+
+def bounding_box_mask(lat, lon, lats, lons, distance):
+    """
+    Mask of the points within the latitude/longitude bounding box of all points closer than distance
+    to a single point. The box is never smaller than the haversine range.
+    """
+    angular_distance = distance / EARTH_RADIUS
+    max_dlat = math.degrees(angular_distance)
+
+    # The longitude span widens towards the poles and covers all longitudes once a pole is in range
+    cos_lat = math.cos(math.radians(lat))
+    if math.sin(angular_distance) < cos_lat:
+        max_dlon = math.degrees(math.asin(math.sin(angular_distance) / cos_lat))
+    else:
+        max_dlon = 180.0
+
+    dlons = np.abs((lons - lon + 180.0) % 360.0 - 180.0)
+
+    return (np.abs(lats - lat) <= max_dlat) & (dlons <= max_dlon)
 
 def extract_words(place_name: str) -> list:
     """
     Extract words from a place name while preserving internal apostrophes.
     """
-    return re.findall(r"[A-Za-z]+(?:'[A-Za-z]+)?", place_name)
-
-def name_overlap_score(name_a: str, name_b: str) -> float:
-    def normalize(name):
-        return {
-            w.lower()
-            for w in re.split(r"\W+", name)
-            if len(w) > 2
-        }
+    return WORD_RE.findall(place_name)
 
-    set_a = normalize(name_a)
-    set_b = normalize(name_b)
+@lru_cache(maxsize=4096)
+def normalize_name(name: str) -> frozenset:
+    """
+    Split a place name into its set of case-folded words, ignoring words with two characters or less.
+    Names of chains and repeated places recur often, so the results are cached.
+    """
+    return frozenset(
+        w
+        for w in NAME_SPLIT_RE.split(name.casefold())
+        if len(w) > 2
+    )
 
-    if not set_a or not set_b:
+def token_overlap_score(tokens_a: frozenset, tokens_b: frozenset) -> float:
+    """
+    Jaccard similarity of two normalized token sets.
+    """
+    if not tokens_a or not tokens_b:
         return 0.0
 
-    intersection = set_a & set_b
-    union = set_a | set_b
+    intersection = len(tokens_a & tokens_b)
+
+    return intersection / (len(tokens_a) + len(tokens_b) - intersection)
 
-    return len(intersection) / len(union)
+def name_overlap_score(name_a: str, name_b: str) -> float:
+    return token_overlap_score(normalize_name(name_a), normalize_name(name_b))
 
 
 class OSMMatcher:
@@ -98,28 +382,62 @@ class OSMMatcher:
         self.update_function = update_function
         self.user_match_selection = user_match_selection
 
-        self.kml_obj = None
+        self.kml_writer = None
         self.place_matching_rules = None
+        self.place_matching_rules_by_key = None
+        self.unkeyed_place_matching_rules = None
         self.data_place_icons = None
+        self.place_icon_index = None
+        self.place_icon_defaults = None
+        self.place_icon_category_rank = None
         self.successful = None
         self.skipped = None
+        self.sum_scores = None
+        self.num_scores = None
 
         self.stop_requested = False
 
+        # Futures of the responses of the current run, keyed by the whitespace-normalized query. Requests that
+        # are still in flight are shared as well.
+        self.query_responses = {}
+        self.query_responses_lock = threading.Lock()
+
+        # Keep the connections to the Overpass endpoints alive across requests
+        self.session = requests.Session()
+        # One pool per endpoint, each large enough for all batch workers to hold a connection at once
+        self.session.mount("https://", HTTPAdapter(pool_connections=len(OVERPASS_ENDPOINTS),
+                                                   pool_maxsize=OVERPASS_WORKERS, max_retries=0))
+        self.session.headers.update({"Accept": "application/json", "Accept-Encoding": "gzip, deflate"})
+
         if allow_self_signed_cert:
             urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
         self.load_place_matching_data()
         self.load_icon_data()
 
+    def close(self):
+        """
+        Close the pooled connections to the Overpass endpoints.
+        """
+        self.session.close()
+
     def load_place_matching_data(self):
         place_mapping_file = Path(PATH_PLACE_MAPPING)
 
         if not place_mapping_file.exists():
             raise FileNotFoundError(place_mapping_file)
 
-        with place_mapping_file.open("r", encoding="utf-8") as f:
-            self.place_matching_rules = parse_mapcss(f)
+        # Parsing the MapCSS file is only necessary if it changed since the rules were cached
+        self.place_matching_rules = read_place_matching_cache(place_mapping_file)
+        if self.place_matching_rules is None:
+            with place_mapping_file.open("r", encoding="utf-8") as f:
+                self.place_matching_rules = parse_mapcss(f)
+            write_place_matching_cache(place_mapping_file, self.place_matching_rules)
+
+        # Only rules sharing a key with a place have to be checked. Rules are referenced by their position
+        # to keep the original order when evaluating them.
+        self.place_matching_rules_by_key, self.unkeyed_place_matching_rules = \
+            index_rules_by_key(self.place_matching_rules)
 
     def load_icon_data(self):
         bookmark_icon_file = Path(PATH_BOOKMARK_ICONS)
@@ -128,22 +446,69 @@ class OSMMatcher:
             raise FileNotFoundError(bookmark_icon_file)
 
         with bookmark_icon_file.open("r", encoding="utf-8") as f:
-            self.data_place_icons = yaml.safe_load(f) or {}
+            # Use the C implementation of the loader if PyYAML was built with libyaml
+            self.data_place_icons = yaml.load(f, Loader=getattr(yaml, "CSafeLoader", yaml.SafeLoader)) or {}
+
+        # Flatten the mapping into (category, value) -> icon and category -> default icon, and keep the
+        # position of each category in the YAML as its priority
+        self.place_icon_index = {}
+        self.place_icon_defaults = {}
+        self.place_icon_category_rank = {category: rank for rank, category in enumerate(self.data_place_icons)}
+        for category, submap in self.data_place_icons.items():
+            for value, icon in submap.items():
+                if value == "default":
+                    self.place_icon_defaults[category] = icon
+                else:
+                    self.place_icon_index[(category, value)] = icon
 
     def overpass_request(self, query: str, timeout: int = 30, max_retries: int = 5):
+        query_key = " ".join(query.split())
+        query_responses = self.query_responses
+        with self.query_responses_lock:
+            response_future = query_responses.get(query_key)
+            is_owner = response_future is None
+            if is_owner:
+                response_future = Future()
+                query_responses[query_key] = response_future
+
+        if not is_owner:
+            log.debug("Using Overpass response of this run")
+            return response_future.result()
+
+        data = None
+        try:
+            data = self.fetch_overpass_response(query, timeout, max_retries)
+        finally:
+            # Failed requests are not kept, so that a later identical query tries again
+            if data is None:
+                with self.query_responses_lock:
+                    query_responses.pop(query_key, None)
+            response_future.set_result(data)
+
+        return data
+
+    def fetch_overpass_response(self, query: str, timeout: int, max_retries: int):
+        cached_data = read_overpass_cache(query)
+        if cached_data is not None:
+            log.debug("Using cached Overpass response")
+            return cached_data
+
         for attempt in range(1, max_retries + 1):
-            url = random.choice(OVERPASS_ENDPOINTS)
+            url = OVERPASS_ENDPOINT_POOL.pick()
+            retry_after = None
 
             try:
-                response = requests.post(
-                    url,
-                    data=query,
-                    timeout=timeout,
-                    headers={"Accept": "application/json"},
-                    verify=not self.allow_self_signed_cert
-                )
+                OVERPASS_ENDPOINT_BUCKETS[url].take()
+                with OVERPASS_ENDPOINT_SLOTS[url]:
+                    response = self.session.post(
+                        url,
+                        data=query,
+                        timeout=timeout,
+                        verify=not self.allow_self_signed_cert
+                    )
 
                 if response.status_code in (429, 504):
+                    retry_after = response.headers.get("Retry-After")
                     raise requests.exceptions.HTTPError(
                         f"{response.status_code} from Overpass"
                     )
@@ -156,7 +521,13 @@ class OSMMatcher:
                     else:
                         raise ValueError("Non-JSON Overpass response")
 
-                return response.json()
+                data = orjson.loads(response.content)
+                # Runtime errors like timeouts are reported in a remark next to partial or empty elements
+                if data.get("remark"):
+                    raise ValueError(f"Overpass runtime error: {data['remark']}")
+                OVERPASS_ENDPOINT_POOL.report_success(url)
+                write_overpass_cache(query, data)
+                return data
 
             except DuplicateError as e:
                 log.warning(
@@ -165,59 +536,62 @@ class OSMMatcher:
                 )
                 break
             except Exception as e:
-                wait = min(2 ** attempt, 30)
+                OVERPASS_ENDPOINT_POOL.report_failure(url)
+                # Full jitter: wait anywhere up to the exponential backoff
+                wait = random.uniform(0, min(2 ** attempt, 30))
+                if retry_after is not None:
+                    try:
+                        wait = max(wait, min(float(retry_after), OVERPASS_RETRY_AFTER_MAX))
+                    except ValueError:
+                        log.debug(f"Ignoring Retry-After header in unsupported format: {retry_after}")
                 log.warning(
                     f"Overpass failed (attempt {attempt}/{max_retries}): {e}. "
-                    f"Retrying in {wait}s"
+                    f"Retrying in {wait:.1f}s"
                 )
                 time.sleep(wait)
 
         log.error("Overpass permanently failed after retries")
         return None
 
-    def search_places_around(self, lat: float, lon: float, place_name: str, place_type: str = "node"):
+    def build_search_statement(self, lat: float, lon: float, place_name: str, place_type: str = "node",
+                               radius: int = None):
         """
-        Search for OSM nodes around given coordinates whose name approximately
-        matches any word from place_name.
-    
-        Parameters:
-            lat (float): latitude
-            lon (float): longitude
-            place_type: Type of the place [node, way, collection]
-            place_name (str): name to match (split by spaces)
+        Build the Overpass QL statement searching for places around given coordinates whose name
+        approximately matches any word from place_name. The radius defaults to the current range.
+
         Returns:
-            list[dict]: list of places with name, coordinates, amenity, and id
+            str: the statement, or None if the name does not contain any usable words
         """
-    
-        # Split name into words, remove short/noisy tokens
-        words = extract_words(place_name)
-    
+        # Split name into words, remove short/noisy tokens. Words with two characters or less are ignored
+        # by the name scoring as well, so a name consisting only of them can't be matched.
+        # The regex is matched case-insensitively, so words differing only in case are dropped.
+        words = list({w.casefold(): w for w in extract_words(place_name) if len(w) > 2}.values())
+
         if not words:
-            return []
-    
+            return None
+
+        # Long words are more selective and cheaper for the server to match, so only the longest few are
+        # searched for if there are any. This can miss places only sharing a shorter word with the name.
+        long_words = sorted((w for w in words if len(w) >= SEARCH_WORD_MIN_LENGTH), key=len, reverse=True)
+        if long_words:
+            words = long_words[:SEARCH_WORDS_MAX]
+
         # Build OR regex: word1|word2|word3
         name_regex = "|".join(words)
-    
-        # Overpass QL query (nodes only)
-        query = f"""
-        [out:json][timeout:{self.timeout}];
-        {place_type}
-          ["name"~"{name_regex}", i]
-          (around:{self.range},{lat},{lon});
-        out center;
+
+        if radius is None:
+            radius = self.range
+
+        return OVERPASS_SEARCH_STATEMENT.format(place_type=place_type, name_regex=name_regex, radius=radius,
+                                                lat=lat, lon=lon)
+
+    @staticmethod
+    def parse_places(elements: list):
+        """
+        Convert Overpass elements into the place dicts used for matching.
         """
-    
-        # print(query)
-    
-        data = self.overpass_request(query, timeout=self.timeout)
-    
-        if data is None:
-            return None
-    
-        # log.debug(f"Search response data: {data}")
-    
         results = []
-        for el in data.get("elements", []):
+        for el in elements:
             tags = el.get("tags", {})
 
             # retrieve lat/lon
@@ -239,11 +613,89 @@ class OSMMatcher:
                 "lon": lon,
                 "original_tags": tags
             })
+
+        return results
+
+    def search_places_around(self, lat: float, lon: float, place_name: str, place_type: str = "node"):
+        """
+        Search for OSM nodes around given coordinates whose name approximately
+        matches any word from place_name.
+    
+        Parameters:
+            lat (float): latitude
+            lon (float): longitude
+            place_type: Type of the place [node, way, collection]
+            place_name (str): name to match (split by spaces)
+        Returns:
+            list[dict]: list of places with name, coordinates, amenity, and id
+        """
+        statement = self.build_search_statement(lat, lon, place_name, place_type)
+
+        if statement is None:
+            return []
+
+        query = OVERPASS_QUERY_HEADER.format(timeout=self.timeout) + statement
+    
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("Overpass query:\n%s", query)
+    
+        data = self.overpass_request(query, timeout=self.timeout)
+    
+        if data is None:
+            return None
     
+        # log.debug(f"Search response data: {data}")
+    
+        return self.parse_places(data.get("elements", []))
+
+    def search_places_around_batch(self, places: dict, place_type: str = "node", radius: int = None):
+        """
+        Search candidates for several places with a single Overpass request.
+
+        Each search statement is followed by a marker element carrying the index of the place,
+        which is used to split the response back into the results of the individual places.
+
+        Parameters:
+            places (dict): index -> (lat, lon, place_name)
+            place_type: Type of the place [node, way, collection]
+            radius (int): search radius in meters, defaults to the current range
+        Returns:
+            dict: index -> list of places, for every place that could be searched
+        """
+        results = {}
+        statements = []
+        for idx, (lat, lon, place_name) in places.items():
+            statement = self.build_search_statement(lat, lon, place_name, place_type, radius)
+            if statement is None:
+                results[idx] = []
+                continue
+            statements.append(f"{statement}make marker idx={idx};out;")
+
+        if not statements:
+            return results
+
+        query = OVERPASS_QUERY_HEADER.format(timeout=self.timeout) + "".join(statements)
+
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("Overpass batch query:\n%s", query)
+
+        data = self.overpass_request(query, timeout=self.timeout)
+
+        if data is None:
+            return results
+
+        elements = []
+        for el in data.get("elements", []):
+            if el.get("type") != "marker":
+                elements.append(el)
+                continue
+            results[int(el["tags"]["idx"])] = self.parse_places(elements)
+            elements = []
+
         return results
 
     def rank_matched_places(self, places: list, target_lat: float, target_lon: float, target_name: str,
-                            max_distance: float = None):
+                            max_distance: float = None, best_only: bool = False):
         """
         Rank OSM places by likelihood of matching the target place.
     
@@ -253,6 +705,7 @@ class OSMMatcher:
             target_lon (float): reference longitude
             target_name (str): original place name
             max_distance (float): maximum acceptable distance in meters
+            best_only (bool): only return the best match, which lets candidates be skipped early
     
         Returns:
             list[dict]: ranked list of matched places (best first)
@@ -264,88 +717,118 @@ class OSMMatcher:
         if max_distance is None:
             max_distance = self.range * 2
     
-        ranked_matches = []
-    
+        # Only places with coordinates can be ranked
+        located_places = []
         for place in places:
-            lat = place.get("lat")
-            lon = place.get("lon")
-    
-            if lat is None or lon is None:
+            if place.get("lat") is None or place.get("lon") is None:
                 log.debug("Lat or lon are none for place")
                 continue
+            located_places.append(place)
 
-            distance = haversine_distance(
-                target_lat, target_lon,
-                lat, lon
-            )
-    
-            if distance > max_distance:
-                log.debug("Distance is larger than max distance")
-                continue
-    
-            # Normalize distance score (closer = better)
-            distance_score = max(0.0, 1.0 - (distance / max_distance))
-    
-            log.debug(f"Distance score: {distance_score}")
-    
-            name_score = name_overlap_score(
-                target_name,
-                place.get("name", "")
-            )
-    
-            log.debug(f"Name score: {name_score}")
-    
-            final_score = (
-                name_score * self.name_weight
-                + distance_score * self.dist_weight
+        if not located_places:
+            return []
+
+        # Compute the distances to all places in one vectorized pass
+        lats = np.fromiter((place["lat"] for place in located_places), dtype=np.float64, count=len(located_places))
+        lons = np.fromiter((place["lon"] for place in located_places), dtype=np.float64, count=len(located_places))
+        # Places outside the bounding box of max_distance can't be in range and skip the haversine
+        distances = np.full(len(located_places), np.inf)
+        in_box = bounding_box_mask(target_lat, target_lon, lats, lons, max_distance)
+        distances[in_box] = haversine_vector(target_lat, target_lon, lats[in_box], lons[in_box])
+
+        within_range = np.flatnonzero(distances <= max_distance)
+        log.debug("%d places are further away than max distance", len(located_places) - len(within_range))
+
+        if len(within_range) == 0:
+            return []
+
+        range_distances = distances[within_range]
+
+        # Normalize distance score (closer = better)
+        distance_scores = np.maximum(0.0, 1.0 - range_distances / max_distance)
+
+        # The target name is the same for all candidates, so it is only normalized once
+        target_tokens = normalize_name(target_name)
+
+        name_weight, dist_weight = self.name_weight, self.dist_weight
+
+        def score_name(j):
+            return token_overlap_score(target_tokens, normalize_name(located_places[within_range[j]].get("name", "")))
+
+        if not target_tokens:
+            # Without usable words in the target name, no candidate can get a name score
+            scored = list(range(len(within_range)))
+            name_scores = np.zeros(len(within_range))
+        elif best_only:
+            # Going outwards from the closest candidate, the name scoring stops as soon as not even a
+            # perfect name match could reach the best final score found so far
+            scored = []
+            name_scores = np.zeros(len(within_range))
+            best_final_score = None
+            for j in np.argsort(range_distances, kind="stable").tolist():
+                distance_part = float(distance_scores[j]) * dist_weight
+                if best_final_score is not None and round(distance_part + name_weight, 3) < best_final_score:
+                    break
+                name_scores[j] = score_name(j)
+                final_score = round(float(name_scores[j]) * name_weight + distance_part, 3)
+                if best_final_score is None or final_score > best_final_score:
+                    best_final_score = final_score
+                scored.append(j)
+            scored.sort()
+            log.debug("Scored names of %d/%d places in range", len(scored), len(within_range))
+        else:
+            scored = list(range(len(within_range)))
+            name_scores = np.fromiter(
+                (score_name(j) for j in scored),
+                dtype=np.float64,
+                count=len(within_range)
             )
-    
-            ranked_matches.append({
-                **place,
-                "distance_m": round(distance, 2),
-                "distance_score": round(distance_score, 3),
-                "name_score": round(name_score, 3),
-                "final_score": round(final_score, 3),
-            })
-    
-        # Sort by total score (best first)
-        ranked_matches.sort(
-            key=lambda p: p["final_score"],
-            reverse=True,
+
+        final_scores = (
+            name_scores * name_weight
+            + distance_scores * dist_weight
         )
-    
-        return ranked_matches
+
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("Distance scores: %s", distance_scores)
+            log.debug("Name scores: %s", name_scores)
+
+        # Sort by total score (best first) and only build the result dicts in that order
+        rounded_final_scores = [round(score, 3) for score in final_scores.tolist()]
+        order = sorted(scored, key=rounded_final_scores.__getitem__, reverse=True)
+        if best_only:
+            order = order[:1]
+
+        return [
+            {
+                **located_places[within_range[j]],
+                "distance_m": round(float(range_distances[j]), 2),
+                "distance_score": round(float(distance_scores[j]), 3),
+                "name_score": round(float(name_scores[j]), 3),
+                "final_score": rounded_final_scores[j],
+            }
+            for j in order
+        ]
     
     def write_to_kml(self, place_name, place_lat, place_lon, place_desc, icon_name=None, feature_types=None):
-        # Create the ExtendedData element with mwm namespace
-        extdata = etree.Element("{http://www.opengis.net/kml/2.2}ExtendedData", nsmap=NSMAP)
-    
-        # Add the mwm:icon element only if icon_name is provided
+        # Add the mwm:icon element only if icon_name is provided and the mwm:featureTypes block
+        # if feature_types are provided
+        extended_data = []
         if icon_name:
-            icon_el = etree.SubElement(extdata, f"{{{MWM_NS}}}icon")
-            icon_el.text = icon_name
-    
-        # Add mwm:featureTypes block if feature_types are provided
+            extended_data.append(MWM.icon(icon_name))
         if feature_types:
-            feature_types_el = etree.SubElement(
-                extdata, f"{{{MWM_NS}}}featureTypes"
-            )
-            for ft in feature_types:
-                value_el = etree.SubElement(
-                    feature_types_el, f"{{{MWM_NS}}}value"
-                )
-                value_el.text = ft
-    
-        # Create the Placemark
+            extended_data.append(MWM.featureTypes(*[MWM.value(ft) for ft in feature_types]))
+
+        # Create the Placemark, coordinates are written with 6 decimals (~0.1 m)
         placemark = KML.Placemark(
             KML.name(place_name),
-            KML.description(place_desc),
-            KML.Point(KML.coordinates(f"{place_lon},{place_lat},0")),
-            extdata
+            KML.description(place_desc or ""),
+            KML.Point(KML.coordinates("%.6f,%.6f,0" % (place_lon, place_lat))),
+            KML.ExtendedData(*extended_data)
         )
     
-        # Append to the Document element
-        self.kml_obj.Document.append(placemark)
+        # Stream the placemark into the Document element, under the namespaces declared on the kml root
+        write_element(self.kml_writer, placemark, level=2)
 
     def get_place_features(self, place_data):
         """
@@ -356,17 +839,22 @@ class OSMMatcher:
             str, list | None, None  (e.g. "Bar", "Building", ...)
         """
         tags = place_data.get("original_tags", {})
-        osm_tags = [OsmTag(key, value) for key, value in tags.items()]
     
+        # Each rule is indexed under a single key, so the candidates contain no duplicates
+        candidate_rules = list(self.unkeyed_place_matching_rules)
+        for key in tags:
+            candidate_rules.extend(self.place_matching_rules_by_key.get(key, ()))
+
         matched_types = list()
-        for type_strings, rule in self.place_matching_rules:
-            if rule.matches(osm_tags):
+        for rule_idx in sorted(candidate_rules):
+            type_strings, rule = self.place_matching_rules[rule_idx]
+            if rule.matches_dict(tags):
                 matched_types.append(type_strings)
     
         feature_types_list = leave_longest_types(matched_types)
         feature_types = convert_list_to_feature_types(feature_types_list)
     
-        log.debug(f"Identified feature-types: {feature_types}")
+        log.debug("Identified feature-types: %s", feature_types)
     
         return feature_types
     
@@ -382,21 +870,27 @@ class OSMMatcher:
         if not isinstance(tags, dict):
             return None
     
-        # Iterate in YAML order to preserve priority
-        for category, submap in self.data_place_icons.items():
-            if category not in tags:
-                continue
-    
-            value = tags.get(category)
+        icon_index, icon_defaults, category_rank = (
+            self.place_icon_index, self.place_icon_defaults, self.place_icon_category_rank
+        )
+
+        # Only visit the categories present in the tags, in YAML order to preserve priority
+        categories = sorted(
+            (key for key in tags if key in category_rank),
+            key=category_rank.__getitem__
+        )
+        for category in categories:
+            value = tags[category]
             if not value:
                 continue
     
             # OSM values already use underscores, so no normalization needed
-            if value in submap:
-                return submap[value]
+            icon = icon_index.get((category, value))
+            if icon is not None:
+                return icon
     
-            if "default" in submap:
-                return submap["default"]
+            if category in icon_defaults:
+                return icon_defaults[category]
     
         return None
     
@@ -476,59 +970,17 @@ class OSMMatcher:
             return UserSelection.OTHER_ITEM, selection
 
 
-    def process_places_to_kml(self, input_file_path: str, output_file_path: str, overwrite_output: bool,
-                              match_method: str = MatchingMethods.BEST, threshold: float = None,
-                              include_skipped: bool = True):
-        self.successful = 0
-        self.skipped = 0
-        scores = []
-    
-        # ---------------------------------------------------------
-        # Validate paths
-        # ---------------------------------------------------------
-        if not os.path.isfile(input_file_path):
-            log.error(f"Input file does not exist: {input_file_path}")
-            return
-    
-        if os.path.exists(output_file_path) and not overwrite_output:
-            log.info(f"Output file exists and overwrite is disabled: {output_file_path}")
-            return
-    
-        if not match_method in [MatchingMethods.BEST, MatchingMethods.THRESHOLD, MatchingMethods.ALL]:
-            log.error(f"Matching method not valid: {match_method}")
-    
-        # ---------------------------------------------------------
-        # Load input file
-        # ---------------------------------------------------------
-        try:
-            with open(input_file_path, "r", encoding="utf-8") as f:
-                data = json.load(f)
-        except Exception as e:
-            log.error(f"Failed to read input file {input_file_path}: {e}")
-            return
-    
-        if data.get("type") != "FeatureCollection":
-            log.error("Input file is not a GeoJSON FeatureCollection")
-            return
-    
-        features = data.get("features", [])
-        log.info(f"Processing {len(features)} places from {input_file_path}")
-    
-        # ---------------------------------------------------------
-        # Prepare KML output
-        # ---------------------------------------------------------
-        self.kml_obj = KML.kml(
-            KML.Document(
-            )
-        )
-    
-        # ---------------------------------------------------------
-        # Main processing loop
-        # ---------------------------------------------------------
+    def process_features(self, features, prefetched_candidates, match_method, threshold, input_file_path):
+        """
+        Match the input features one by one and write their placemarks through the KML writer.
+
+        Returns:
+            bool: True if all features were processed, False if the processing was stopped
+        """
         for idx, feature in enumerate(features, start=1):
             if self.stop_requested:
                 log.warning(f"Stop requested. Terminating now.")
-                return
+                return False
 
             self.range = DEFAULT_RANGE
 
@@ -550,17 +1002,26 @@ class OSMMatcher:
     
                 while not match_successful:
                     log.info(f"[{idx}/{len(features)}] Matching place: {place_name}")
-                    log.debug(f"Source Data: {lat, lon, self.range, place_name}")
+                    log.debug("Source Data: %s", (lat, lon, self.range, place_name))
     
                     # ---- correct call ----
-                    candidates = self.search_places_around(
-                        lat=lat,
-                        lon=lon,
-                        place_name=place_name,
-                        place_type="nwr"
-                    )
-    
-                    log.debug(f"Candidates: {candidates}")
+                    # Prefetched candidates are only valid for the default range of the first attempt
+                    candidates = None
+                    future = prefetched_candidates.pop(idx, None)
+                    if future is not None:
+                        try:
+                            candidates = future.result().get(idx)
+                        except Exception as e:
+                            log.warning(f"Batched Overpass search failed, searching place individually: {e}")
+                    if candidates is None:
+                        candidates = self.search_places_around(
+                            lat=lat,
+                            lon=lon,
+                            place_name=place_name,
+                            place_type="nwr"
+                        )
+    
+                    log.debug("Candidates: %s", candidates)
     
                     if not candidates:
                         if self.handle_empty_osm_data(lat, lon, place_name, place_desc, match_method, input_file_path):
@@ -575,6 +1036,7 @@ class OSMMatcher:
                         target_lat=lat,
                         target_lon=lon,
                         target_name=place_name,
+                        best_only=(match_method == MatchingMethods.BEST),
                     )
     
                     if not candidates:
@@ -596,9 +1058,9 @@ class OSMMatcher:
                         score = ranked_matches[0].get("final_score", 0.0)
                         if score >= threshold:
                             best_match = ranked_matches[0]
-                            log.debug(f"Best match score is above threshold: {score} >= {threshold}. Using best match.")
+                            log.debug("Best match score is above threshold: %s >= %s. Using best match.", score, threshold)
                         else:
-                            log.debug(f"Best match score is below threshold: {score} < {threshold}. Requiring user input.")
+                            log.debug("Best match score is below threshold: %s < %s. Requiring user input.", score, threshold)
                             user_choice, selection = self.retrieve_user_selection(lat, lon, place_name, place_desc,
                                                                                   ranked_matches, input_file_path)
                             if user_choice == UserSelection.NEW_RADIUS:
@@ -606,7 +1068,7 @@ class OSMMatcher:
                             elif user_choice == UserSelection.VALID_ITEM:
                                 best_match = ranked_matches[selection]
                             elif user_choice == UserSelection.EXIT:
-                                return
+                                return False
                             else:
                                 break
 
@@ -618,7 +1080,7 @@ class OSMMatcher:
                         elif user_choice == UserSelection.VALID_ITEM:
                             best_match = ranked_matches[selection]
                         elif user_choice == UserSelection.EXIT:
-                            return
+                            return False
                         else:
                             break
                     else:
@@ -630,7 +1092,8 @@ class OSMMatcher:
                     feature_types = self.get_place_features(best_match)
     
                     score = best_match.get("final_score", 0.0)
-                    scores.append(score)
+                    self.sum_scores += score
+                    self.num_scores += 1
     
                     osm_lat = best_match["lat"]
                     osm_lon = best_match["lon"]
@@ -651,17 +1114,116 @@ class OSMMatcher:
             # Update AFTER each feature
             # -----------------------------------------------------
             self.update_function(input_file_path, self.successful, self.skipped)
+
+        return True
+
+    def process_places_to_kml(self, input_file_path: str, output_file_path: str, overwrite_output: bool,
+                              match_method: str = MatchingMethods.BEST, threshold: float = None,
+                              include_skipped: bool = True):
+        self.successful = 0
+        self.skipped = 0
+        self.query_responses = {}
+        self.sum_scores = 0.0
+        self.num_scores = 0
     
         # ---------------------------------------------------------
-        # Finalize KML
+        # Validate paths
+        # ---------------------------------------------------------
+        if not os.path.isfile(input_file_path):
+            log.error(f"Input file does not exist: {input_file_path}")
+            return
+    
+        if os.path.exists(output_file_path) and not overwrite_output:
+            log.info(f"Output file exists and overwrite is disabled: {output_file_path}")
+            return
+    
+        if not match_method in [MatchingMethods.BEST, MatchingMethods.THRESHOLD, MatchingMethods.ALL]:
+            log.error(f"Matching method not valid: {match_method}")
+    
+        # ---------------------------------------------------------
+        # Load input file
         # ---------------------------------------------------------
         try:
-            with open(output_file_path, "wb") as f:
-                f.write(etree.tostring(self.kml_obj, pretty_print=True, xml_declaration=True, encoding="UTF-8"))
+            with open(input_file_path, "rb") as f:
+                data = orjson.loads(f.read())
         except Exception as e:
-            log.error(f"Failed to finalize KML file: {e}")
+            log.error(f"Failed to read input file {input_file_path}: {e}")
+            return
+    
+        if data.get("type") != "FeatureCollection":
+            log.error("Input file is not a GeoJSON FeatureCollection")
+            return
+    
+        features = data.get("features", [])
+        log.info(f"Processing {len(features)} places from {input_file_path}")
     
-        avg_score = sum(scores) / len(scores) if scores else 0.0
+        # ---------------------------------------------------------
+        # Fetch the candidates of all places in batches, in the background
+        # ---------------------------------------------------------
+        prune_overpass_cache()
+
+        batch_places = {}
+        for idx, feature in enumerate(features, start=1):
+            # Malformed features are skipped with a warning in the main loop
+            if not isinstance(feature, dict):
+                continue
+            geometry = feature.get("geometry") or {}
+            coordinates = geometry.get("coordinates")
+            if geometry.get("type") != "Point" or not coordinates or len(coordinates) != 2:
+                continue
+            lon, lat = coordinates
+            batch_places[idx] = (lat, lon, (feature.get("properties") or {}).get("name", "Unknown"))
+
+        # Every place maps to the future of the batch it is fetched in
+        prefetched_candidates = {}
+        batch_indices = list(batch_places.keys())
+        executor = ThreadPoolExecutor(max_workers=OVERPASS_WORKERS)
+        for i in range(0, len(batch_indices), OVERPASS_BATCH_SIZE):
+            batch = {idx: batch_places[idx] for idx in batch_indices[i:i + OVERPASS_BATCH_SIZE]}
+            future = executor.submit(self.search_places_around_batch, batch, "nwr", DEFAULT_RANGE)
+            prefetched_candidates.update(dict.fromkeys(batch, future))
+        # The submitted batches keep running, the threads are released once they are done
+        executor.shutdown(wait=False)
+
+        # ---------------------------------------------------------
+        # Main processing loop, the placemarks are streamed into a partial
+        # file that replaces the output file once all places are processed
+        # ---------------------------------------------------------
+        part_file_path = f"{output_file_path}.part"
+        try:
+            with etree.xmlfile(part_file_path, encoding="UTF-8") as kml_file:
+                kml_file.write_declaration()
+                # The placemarks are indented by write_element, the enclosing elements are indented here
+                with kml_file.element(f"{{{KML_NS}}}kml", nsmap=KML_NSMAP):
+                    kml_file.write("\n  ")
+                    with kml_file.element(f"{{{KML_NS}}}Document"):
+                        self.kml_writer = kml_file
+                        completed = self.process_features(features, prefetched_candidates, match_method,
+                                                          threshold, input_file_path)
+                        kml_file.write("\n  ")
+                    kml_file.write("\n")
+
+            if not completed:
+                return
+
+            # ---------------------------------------------------------
+            # Finalize KML
+            # ---------------------------------------------------------
+            os.replace(part_file_path, output_file_path)
+        except OSError as e:
+            log.error(f"Failed to finalize KML file: {e}")
+        finally:
+            # Batches that haven't started are dropped, the executor would otherwise keep sending them
+            # to Overpass after the processing stopped
+            for future in prefetched_candidates.values():
+                future.cancel()
+            # The responses are only shared within a run, release them with it
+            self.query_responses = {}
+            self.kml_writer = None
+            if os.path.exists(part_file_path):
+                os.remove(part_file_path)
+    
+        avg_score = self.sum_scores / self.num_scores if self.num_scores else 0.0
         log.info(
             f"Finished processing {input_file_path}: "
             f"{self.successful} matched, {self.skipped} skipped, "
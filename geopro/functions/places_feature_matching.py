@@ -1,47 +1,45 @@
-import csv
-import re
-from dataclasses import dataclass, field
-from typing import List, Tuple, TextIO
+import sys
+from dataclasses import dataclass
+from typing import Dict, List, NamedTuple, Set, Tuple, TextIO
 
 
 TypeStrings = List[str]
 
-@dataclass
-class OsmTag:
+class OsmTag(NamedTuple):
     key: str
     value: str
 
-    def __init__(self, key, value):
-        self.key = key
-        self.value = value
-
-    def __eq__(self, other):
-        return self.key == other.key and self.value == other.value
-
 # Define a Python representation of a MapCSS rule.
-# m_tags: list of (key, value) tuples
-# m_mandatoryKeys: list of mandatory keys
-# m_forbiddenKeys: list of forbidden keys
+# The terms are stored as tuples, as a rule is not changed after parsing.
+# m_tags: tuple of (key, value) tags
+# m_mandatoryKeys: tuple of mandatory keys
+# m_forbiddenKeys: tuple of forbidden keys
 @dataclass
 class MapcssRule:
-    m_tags: List[OsmTag] = field(default_factory=list)
-    m_mandatoryKeys: List[str] = field(default_factory=list)
-    m_forbiddenKeys: List[str] = field(default_factory=list)
-
-    def matches(self, tags: List[OsmTag]):
-        # All required tags must be present
-        for tag in self.m_tags:
-            if not any(t == tag for t in tags):
+    m_tags: Tuple[OsmTag, ...] = ()
+    m_mandatoryKeys: Tuple[str, ...] = ()
+    m_forbiddenKeys: Tuple[str, ...] = ()
+
+    @property
+    def required_keys(self) -> Set[str]:
+        # Keys that have to be present for the rule to match
+        return {tag.key for tag in self.m_tags} | set(self.m_mandatoryKeys)
+
+    def matches_dict(self, tags: Dict[str, str]):
+        # The tags are given as {key: value} to look them up directly.
+        # The forbidden and mandatory keys are checked first, so a rule can fail on its first lookup.
+        for key in self.m_forbiddenKeys:
+            value = tags.get(key)
+            if value is not None and value != "no":
                 return False
 
-        # Mandatory keys must exist with value != "no"
         for key in self.m_mandatoryKeys:
-            if not any(t.key == key and t.value != "no" for t in tags):
+            value = tags.get(key)
+            if value is None or value == "no":
                 return False
 
-        # Forbidden keys must not exist unless value == "no"
-        for key in self.m_forbiddenKeys:
-            if not all(t.key != key or t.value == "no" for t in tags):
+        for tag in self.m_tags:
+            if tags.get(tag.key) != tag.value:
                 return False
 
         return True
@@ -51,87 +49,89 @@ class MapcssRule:
 # Each entry is a tuple of type tokens and a MapcssRule.
 MapcssRules = List[Tuple[List[str], MapcssRule]]
 
+# Type alias for an index of rule positions by the keys they require
+MapcssRulesIndex = Dict[str, List[int]]
 
-def parse_mapcss(file_obj: TextIO) -> MapcssRules:
-    """
-    Parse a MapCSS file and return a list of MapCSS rules.
 
-    Each rule is represented as a tuple of type tokens (list of strings)
-    and a MapcssRule object with tags, mandatory keys, and forbidden keys.
+# Helper function to process "short" format rules (3 CSV fields)
+def _process_short(rules: MapcssRules, type_string: str) -> None:
+    type_tokens = type_string.split("|")
+    if len(type_tokens) != 2:
+        raise ValueError(f"Invalid short type string: {type_string}")
 
-    Args:
-        file_obj: A file-like object open for reading text.
+    # The single tag in short format
+    rule = MapcssRule(m_tags=(OsmTag(sys.intern(type_tokens[0]), sys.intern(type_tokens[1])),))
+    rules.append((type_tokens, rule))
 
-    Returns:
-        List of tuples: [(typeTokens: List[str], rule: MapcssRule), ...]
-    """
 
-    rules: MapcssRules = []
+# Helper function to process "full" format rules (7 CSV fields)
+def _process_full(rules: MapcssRules, type_string: str, selectors_string: str) -> None:
+    if not type_string or not selectors_string:
+        raise ValueError("Empty type string or selectors string")
 
-    # Helper function to process "short" format rules (3 CSV fields)
-    def process_short(type_string: str) -> None:
-        type_tokens = type_string.split("|")
-        if len(type_tokens) != 2:
-            raise ValueError(f"Invalid short type string: {type_string}")
+    type_tokens = type_string.split("|")
 
-        rule = MapcssRule()
-        # The single tag in short format
-        rule.m_tags.append(OsmTag(type_tokens[0], type_tokens[1]))
-        rules.append((type_tokens, rule))
+    # Each selector is separated by comma
+    for selector in selectors_string.split(","):
+        selector = selector.strip()
 
-    # Helper function to process "full" format rules (7 CSV fields)
-    def process_full(type_string: str, selectors_string: str) -> None:
-        if not type_string or not selectors_string:
-            raise ValueError("Empty type string or selectors string")
+        if selector == "":
+            continue
+        if not (selector.startswith("[") and selector.endswith("]")):
+            raise ValueError(f"Invalid selector format: {selector}")
 
-        type_tokens = type_string.split("|")
+        tags = []
+        mandatory_keys = []
+        forbidden_keys = []
 
-        # Each selector is separated by comma
-        for selector in selectors_string.split(","):
-            selector = selector.strip()
+        # Remove outer brackets and split inner content between the brackets
+        inner_parts = selector[1:-1].split("][")
 
-            if selector == "":
-                continue
-            if not (selector.startswith("[") and selector.endswith("]")):
-                raise ValueError(f"Invalid selector format: {selector}")
+        for kv in inner_parts:
+            raw_key, separator, value = kv.partition("=")
 
-            rule = MapcssRule()
+            # Case 1: Only key present (mandatory or forbidden)
+            if not separator:
+                forbidden = raw_key.startswith("!")
+                # Strip the leading ! and the trailing ? of [key?]
+                key = sys.intern(raw_key.strip("?!"))
 
-            # Remove outer brackets and split inner content on brackets
-            inner_parts = re.split(r'[\[\]]', selector)
-            # re.split produces empty strings for brackets; filter them out
-            inner_parts = [part for part in inner_parts if part]
+                if forbidden:
+                    forbidden_keys.append(key)
+                else:
+                    mandatory_keys.append(key)
 
-            for kv in inner_parts:
-                tag_tokens = kv.split("=")
+            # Case 2: Key=value pair
+            elif "=" not in value:
+                # Keys and values repeat across many rules, interned they compare by identity
+                tags.append(OsmTag(sys.intern(raw_key), sys.intern(value)))
+            else:
+                raise ValueError(f"Invalid tag format in selector: {kv}")
 
-                # Case 1: Only key present (mandatory or forbidden)
-                if len(tag_tokens) == 1:
-                    raw_key = tag_tokens[0]
-                    forbidden = raw_key.startswith("!")
-                    # Strip ! and ? characters
-                    key = raw_key.strip("?!")
+        rule = MapcssRule(tuple(tags), tuple(mandatory_keys), tuple(forbidden_keys))
+        rules.append((type_tokens, rule))
 
-                    if forbidden:
-                        rule.m_forbiddenKeys.append(key)
-                    else:
-                        rule.m_mandatoryKeys.append(key)
 
-                # Case 2: Key=value pair
-                elif len(tag_tokens) == 2:
-                    key, value = tag_tokens
-                    rule.m_tags.append(OsmTag(key, value))
-                else:
-                    raise ValueError(f"Invalid tag format in selector: {kv}")
+def parse_mapcss(file_obj: TextIO) -> MapcssRules:
+    """
+    Parse a MapCSS file and return a list of MapCSS rules.
 
-            rules.append((type_tokens, rule))
+    Each rule is represented as a tuple of type tokens (list of strings)
+    and a MapcssRule object with tags, mandatory keys, and forbidden keys.
 
-    # Read CSV lines, preserving empty fields and trimming whitespace
-    reader = csv.reader(file_obj, delimiter=";", skipinitialspace=True)
+    Args:
+        file_obj: A file-like object open for reading text.
 
-    for fields in reader:
-        if not fields:
-            continue
+    Returns:
+        List of tuples: [(typeTokens: List[str], rule: MapcssRule), ...]
+    """
+
+    rules: MapcssRules = []
+
+    # Read the ';'-separated lines, preserving empty fields and trimming leading whitespace.
+    # The file uses no quoting, so plain splitting is enough.
+    for line in file_obj:
+        fields = [field.lstrip() for field in line.rstrip("\r\n").split(";")]
 
         # Skip comments and empty lines
         line_first_field = fields[0].strip()
@@ -144,15 +144,58 @@ def parse_mapcss(file_obj: TextIO) -> MapcssRules:
 
         # Short format (3 fields, third field empty)
         if len(fields) == 3 and fields[2] == "":
-            process_short(fields[0])
+            _process_short(rules, fields[0])
 
         # Full format (7 fields, third field not 'x')
         if len(fields) == 7 and fields[2] != "x":
-            process_full(fields[0], fields[1])
+            _process_full(rules, fields[0], fields[1])
 
     return rules
 
 
+def intern_rules(rules: MapcssRules) -> None:
+    """
+    Intern the keys and values of rules that were not created by parse_mapcss, e.g. loaded from a pickle.
+    """
+    for _, rule in rules:
+        rule.m_tags = tuple(OsmTag(sys.intern(tag.key), sys.intern(tag.value)) for tag in rule.m_tags)
+        rule.m_mandatoryKeys = tuple(map(sys.intern, rule.m_mandatoryKeys))
+        rule.m_forbiddenKeys = tuple(map(sys.intern, rule.m_forbiddenKeys))
+
+
+def index_rules_by_key(rules: MapcssRules) -> Tuple[MapcssRulesIndex, List[int]]:
+    """
+    Index the positions of MapCSS rules by their rarest required key.
+
+    A rule can only match tags containing all of its required keys, so it is enough to index it under
+    one of them. Using the key required by the fewest rules keeps the lists of the common keys short,
+    and only the rules indexed under one of the keys of a tag set need to be checked for it.
+
+    Args:
+        rules: The rules as returned by parse_mapcss.
+
+    Returns:
+        Tuple of the index {key: [rule positions]} and the positions of the rules without required keys,
+        which have to be checked for every tag set.
+    """
+    rules_by_key: MapcssRulesIndex = {}
+    unkeyed_rules: List[int] = []
+
+    required_keys = [rule.required_keys for _, rule in rules]
+    key_counts: Dict[str, int] = {}
+    for keys in required_keys:
+        for key in keys:
+            key_counts[key] = key_counts.get(key, 0) + 1
+
+    for rule_idx, keys in enumerate(required_keys):
+        if not keys:
+            unkeyed_rules.append(rule_idx)
+            continue
+        rarest_key = min(keys, key=lambda key: (key_counts[key], key))
+        rules_by_key.setdefault(rarest_key, []).append(rule_idx)
+
+    return rules_by_key, unkeyed_rules
+
 
 def leave_longest_types(matched_types: List[TypeStrings]) -> List[TypeStrings]:
     """
@@ -169,12 +212,16 @@ def leave_longest_types(matched_types: List[TypeStrings]) -> List[TypeStrings]:
         return lhs[:compare_len] == rhs[:compare_len]
 
     result: List[TypeStrings] = []
+    # Types can only have an equal prefix if their first components are equal, so each type is only
+    # compared to the kept types with the same first component
+    result_by_first: Dict[str, List[TypeStrings]] = {}
 
     for t in matched_types:
         keep = True
         to_remove = []
+        bucket = result_by_first.setdefault(t[0], [])
 
-        for existing in result:
+        for existing in bucket:
             if equal_prefix(t, existing):
                 if len(t) > len(existing):
                     # New one is better → remove shorter existing
@@ -188,16 +235,18 @@ def leave_longest_types(matched_types: List[TypeStrings]) -> List[TypeStrings]:
                     pass
 
         if keep:
-            for r in to_remove:
-                result.remove(r)
+            if to_remove:
+                # Filter by identity in one pass instead of list.remove comparing lists per removal
+                removed = set(map(id, to_remove))
+                result = [r for r in result if id(r) not in removed]
+                bucket[:] = [r for r in bucket if id(r) not in removed]
             result.append(t)
+            bucket.append(t)
 
     return result
 
 def convert_list_to_feature_types(feature_list):
-    # concatenate all strings from one feature with '-'
-    feature_types = ['-'.join(features) for features in feature_list]
-    # remove duplicates
-    feature_types = list(set(feature_types))
+    # concatenate all strings from one feature with '-' and remove duplicates, keeping the order
+    feature_types = list(dict.fromkeys('-'.join(features) for features in feature_list))
 
     return feature_types
\ No newline at end of file
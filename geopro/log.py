@@ -6,22 +6,25 @@ from PyQt5.QtCore import QObject, pyqtSignal
 from PyQt5.QtWidgets import QTextEdit
 
 
+# Shared by the console handlers of all loggers
+_FORMATTER = colorlog.ColoredFormatter(
+    "%(log_color)s%(asctime)s [%(levelname)s] %(message)s",
+    log_colors={
+        "DEBUG": "cyan",
+        "INFO": "green",
+        "WARNING": "yellow",
+        "ERROR": "red",
+        "CRITICAL": "bold_red",
+    },
+)
+
+
 def setup_logging(logger_name):
     log = logging.getLogger(logger_name)
 
     if not log.handlers:  # ← CRITICAL
         handler = logging.StreamHandler(sys.stdout)
-        formatter = colorlog.ColoredFormatter(
-            "%(log_color)s%(asctime)s [%(levelname)s] %(message)s",
-            log_colors={
-                "DEBUG": "cyan",
-                "INFO": "green",
-                "WARNING": "yellow",
-                "ERROR": "red",
-                "CRITICAL": "bold_red",
-            },
-        )
-        handler.setFormatter(formatter)
+        handler.setFormatter(_FORMATTER)
         log.addHandler(handler)
         log.setLevel(logging.INFO)
         log.propagate = False
@@ -29,7 +29,7 @@ def decompose_key(cpp_key: str):
     - Ignore anything after the second dash
     - If only one level exists, use 'default'
     """
-    parts = cpp_key.split("-")
+    parts = cpp_key.split("-", 2)
 
     if len(parts) == 1:
         return parts[0], "default"
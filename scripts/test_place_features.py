@@ -1,6 +1,6 @@
 from pathlib import Path
 
-from geopro.functions.places_feature_matching import OsmTag, leave_longest_types, parse_mapcss, convert_list_to_feature_types
+from geopro.functions.places_feature_matching import leave_longest_types, parse_mapcss, convert_list_to_feature_types
 from geopro.config import PATH_PLACE_MAPPING
 
 
@@ -20,8 +20,6 @@ tags_dict = {'bench': 'yes', 'bin': 'yes', 'bus': 'yes', 'highway': 'bus_stop',
 
 # tags_dict = {'description': 'Münchner Freiheit, Stop Tram 23 Richtung Schwabing Nord und Ausstieg Tram 23 (Endhaltestelle)', 'local_ref': '1', 'name': 'Münchner Freiheit', 'operator': 'MVG', 'public_transport': 'stop_position', 'railway': 'stop', 'ref': '7', 'ref:IFOPT': 'de:09162:500:1:7', 'tram': 'yes', 'wheelchair': 'yes'}
 
-tags = [OsmTag(key, value) for key, value in tags_dict.items()]
-
 place_mapping_file = Path(PATH_PLACE_MAPPING)
 
 if not place_mapping_file.exists():
@@ -32,7 +30,7 @@ with place_mapping_file.open("r", encoding="utf-8") as f:
 
 matched_types = list()
 for type_strings, rule in rules:
-    if rule.matches(tags):
+    if rule.matches_dict(tags_dict):
         matched_types.append(type_strings)
 
 print(matched_types)